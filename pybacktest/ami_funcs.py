@@ -4,14 +4,154 @@
 to help translate strategies from AmiScript.
 
 Note that most AmiScript's built-in funtions have more advanced native analogs
-in pandas. Funcs like that will not be replicated here.
+in pandas. Funcs like that will not be replicated here, with exception of
+common indicators (MA, EMA, HHV, LLV, ATR, Cross). Window-based ones are
+memoized in `indicator_cache`, so strategy run over many parameter sets (see
+Optimizer) computes each indicator for each window only once per process.
+
+Cached values are looked up by identity of input data, not its contents:
+neither series passed to memoized indicators nor series returned by them
+may be modified inplace, or stale values will be returned.
 
 """
 
+import collections
+import functools
+import inspect
+import numbers
+import threading
+
+import numpy
 import pandas
 
 
-__all__ = ['ExRem', 'BarsSince', 'TimeNum', 'DateNum']
+__all__ = ['ExRem', 'BarsSince', 'TimeNum', 'DateNum',
+           'MA', 'EMA', 'HHV', 'LLV', 'ATR', 'Cross', 'indicator_cache']
+
+
+# default size limit of indicator cache
+CACHE_BYTES = 256 * 2**20
+
+
+class IndicatorCache(object):
+    """
+    LRU cache of indicator values, bounded by `maxbytes` of cached results
+    and series they were computed from. Inputs are identified by their
+    underlying data buffer and index, and kept referenced while cached (so
+    buffer cannot be reused by other data). Input shared by several cached
+    values is accounted only once.
+    """
+
+    def __init__(self, maxbytes=CACHE_BYTES):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._inputs = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._inputs.clear()
+            self.nbytes = self.hits = self.misses = 0
+
+    def get(self, key, args, fn):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        value = fn(*args)
+        inputs = _input_sizes(args)
+        with self._lock:
+            self.misses += 1
+            size = value.nbytes + sum(
+                n for k, n in inputs.items() if k not in self._inputs)
+            if key in self._data or size > self.maxbytes:
+                return value
+            for k, n in inputs.items():
+                self._inputs.setdefault(k, [0, n])[0] += 1
+            self._data[key] = (args, value, list(inputs))
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                self._evict()
+        return value
+
+    def _evict(self):
+        _, (_, value, inputs) = self._data.popitem(last=False)
+        self.nbytes -= value.nbytes
+        for k in inputs:
+            ref = self._inputs[k]
+            ref[0] -= 1
+            if not ref[0]:
+                del self._inputs[k]
+                self.nbytes -= ref[1]
+
+
+indicator_cache = IndicatorCache()
+
+
+def _array_key(v):
+    if isinstance(v, numpy.ndarray):
+        return (v.__array_interface__['data'][0], v.shape, v.strides,
+                v.dtype.str)
+
+
+def _index_key(ix):
+    if isinstance(ix, pandas.RangeIndex):
+        return ('range', ix.start, ix.stop, ix.step)
+    if not isinstance(ix, pandas.MultiIndex):
+        key = _array_key(ix.values)
+        if key is not None:
+            return key
+    return id(ix)
+
+
+def _cache_key(x):
+    if isinstance(x, pandas.DataFrame):
+        return tuple((c, _cache_key(x[c])) for c in x.columns)
+    if isinstance(x, pandas.Series):
+        key = _array_key(x.values)
+        if key is None:
+            return id(x)
+        return key + (_index_key(x.index),)
+    if isinstance(x, numbers.Integral) or \
+            (isinstance(x, numbers.Real) and float(x).is_integer()):
+        return int(x)
+    return x
+
+
+def _input_sizes(args):
+    sizes = {}
+    for a in args:
+        if isinstance(a, pandas.DataFrame):
+            a = [a[c] for c in a.columns]
+        elif isinstance(a, pandas.Series):
+            a = [a]
+        else:
+            continue
+        for x in a:
+            sizes[_cache_key(x)] = x.nbytes
+    return sizes
+
+
+def _memoized(fn):
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        args = bound.args
+        key = (fn.__name__,) + tuple(_cache_key(a) for a in args)
+        return indicator_cache.get(key, args, fn).copy(deep=False)
+    return wrapper
 
 
 def ExRem(array1, array2):
@@ -68,3 +208,73 @@ def DateNum(x):
     """
     datecode = [10000 * (x.year - 1900) + 100 * x.month + x.day for x in [x.date() for x in x.index]]
     return pandas.Series(datecode, index=x.index)
+
+
+@_memoized
+def MA(array, periods):
+    """ Simple moving average.
+
+    Reference implementation:
+    http://www.amibroker.com/guide/afl/afl_view.php?name=ma
+
+    """
+    return array.rolling(int(periods)).mean()
+
+
+@_memoized
+def EMA(array, periods):
+    """ Exponential moving average.
+
+    Reference implementation:
+    http://www.amibroker.com/guide/afl/afl_view.php?name=ema
+
+    """
+    return array.ewm(span=periods, adjust=False).mean()
+
+
+@_memoized
+def HHV(array, periods):
+    """ Highest value over periods.
+
+    Reference implementation:
+    http://www.amibroker.com/guide/afl/afl_view.php?name=hhv
+
+    """
+    return array.rolling(int(periods)).max()
+
+
+@_memoized
+def LLV(array, periods):
+    """ Lowest value over periods.
+
+    Reference implementation:
+    http://www.amibroker.com/guide/afl/afl_view.php?name=llv
+
+    """
+    return array.rolling(int(periods)).min()
+
+
+@_memoized
+def ATR(ohlc, periods):
+    """ Average true range of bars dataframe (with H, L, C columns),
+    using Wilder's smoothing.
+
+    Reference implementation:
+    http://www.amibroker.com/guide/afl/afl_view.php?name=atr
+
+    """
+    pc = ohlc.C.shift()
+    tr = pandas.concat([ohlc.H - ohlc.L, (ohlc.H - pc).abs(),
+                        (ohlc.L - pc).abs()], axis=1).max(axis=1)
+    return tr.ewm(alpha=1. / periods, adjust=False).mean()
+
+
+def Cross(array1, array2):
+    """ True when array1 crosses array2 from below. array2 may be scalar.
+
+    Reference implementation:
+    http://www.amibroker.com/guide/afl/afl_view.php?name=cross
+
+    """
+    prev2 = array2.shift() if isinstance(array2, pandas.Series) else array2
+    return (array1 > array2) & (array1.shift() <= prev2)
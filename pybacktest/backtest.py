@@ -3,11 +3,13 @@
 # part of pybacktest package: https://github.com/ematvey/pybacktest
 
 
+import numbers
 import time
 
 from cached_property import cached_property
 import pybacktest.performance
 import pybacktest.parts
+import numpy
 import pandas
 
 
@@ -58,7 +60,11 @@ class Backtest(object):
     def __init__(self, dataobj, name='Unknown',
                  signal_fields=('buy', 'sell', 'short', 'cover'),
                  price_fields=('buyprice', 'sellprice', 'shortprice',
-                               'coverprice')):
+                               'coverprice'),
+                 stop_loss=None, take_profit=None, trailing_stop=None,
+                 stop_type=None,
+                 stop_fields=('stop_loss', 'take_profit', 'trailing_stop',
+                              'stop_type')):
         """
         Arguments:
 
@@ -79,6 +85,23 @@ class Backtest(object):
         Open price of next bar. By default follows AmiBroker's naming
         convention.
 
+        *stop_loss*, *take_profit* and *trailing_stop* specify distances
+        from entry price (or, for trailing stop, from highest high / lowest
+        low since entry) at which position is closed. Stops are checked
+        against H/L of bars starting from the one after entry, and are filled
+        at stop level, or at open price if market gapped through it. If both
+        stop and target are hit within the same bar, stop is assumed to be
+        hit first. With stops, exit signal always closes whole position.
+
+        *stop_type* is either 'point' (distances are in price units, default)
+        or 'percent' (distances are fractions of price, e.g. 0.02).
+
+        *stop_fields* specifies names of stop settings that backtester will
+        attempt to extract from dataobj, in order of stop_loss, take_profit,
+        trailing_stop and stop_type arguments, so strategy function can set
+        (and Optimizer can sweep) them as its parameters. Only scalar values
+        are picked up; settings passed as arguments take precedence.
+
         Also, dataobj should contain dataframe with Bars of underlying
         instrument. We will attempt to guess its name before failing miserably.
 
@@ -89,6 +112,14 @@ class Backtest(object):
         self._sig_mask_ext = signal_fields
         self._pr_mask_ext = price_fields
         self.name = name
+        self._stop_mask_ext = stop_fields
+        self.stop_loss, self.take_profit, self.trailing_stop = [
+            self._stop_setting(v, f, numbers.Real) for v, f in
+            zip((stop_loss, take_profit, trailing_stop), stop_fields[:3])]
+        self.stop_type = self._stop_setting(stop_type, stop_fields[3],
+                                            str) or 'point'
+        if self.stop_type not in ('point', 'percent'):
+            raise ValueError("Unknown stop type '%s'" % self.stop_type)
         self.trdplot = self.sigplot = pybacktest.parts.Slicer(self.plot_trades,
                                                    obj=self.ohlc)
         self.eqplot = pybacktest.parts.Slicer(self.plot_equity, obj=self.ohlc)
@@ -98,6 +129,13 @@ class Backtest(object):
     def __repr__(self):
         return "Backtest(%s, %s)" % (self.name, self.run_time)
 
+    def _stop_setting(self, value, field, kind):
+        if value is None:
+            v = self.dataobj.get(field.lower())
+            if isinstance(v, kind) and not isinstance(v, bool):
+                return v
+        return value
+
     @property
     def dataobj(self):
         return self._dataobj
@@ -117,7 +155,7 @@ class Backtest(object):
         return self.ohlc.O  # .shift(-1)
 
     @cached_property
-    def trade_price(self):
+    def signal_price(self):
         pr = self.prices
         if pr is None:
             return self.ohlc.O  # .shift(-1)
@@ -128,10 +166,37 @@ class Backtest(object):
             dp[s] = p[s]
         return dp.combine_first(self.default_price)
 
+    @cached_property
+    def trade_price(self):
+        if not self.has_stops:
+            return self.signal_price
+        return self.stop_fills.combine_first(self.signal_price)
+
+    @property
+    def has_stops(self):
+        return any(x is not None for x in (self.stop_loss, self.take_profit,
+                                           self.trailing_stop))
+
+    @cached_property
+    def _positions_and_stops(self):
+        if not self.has_stops:
+            return (pybacktest.parts.signals_to_positions(
+                self.signals, mask=self._sig_mask_int),
+                pandas.Series(dtype=float))
+        return pybacktest.parts.signals_to_positions_with_stops(
+            self.signals, self.ohlc, self.signal_price,
+            stop_loss=self.stop_loss, take_profit=self.take_profit,
+            trailing_stop=self.trailing_stop, stop_type=self.stop_type,
+            mask=self._sig_mask_int)
+
     @cached_property
     def positions(self):
-        return pybacktest.parts.signals_to_positions(self.signals,
-                                          mask=self._sig_mask_int)
+        return self._positions_and_stops[0]
+
+    @cached_property
+    def stop_fills(self):
+        """ Prices at which positions were closed by stops. """
+        return self._positions_and_stops[1]
 
     @cached_property
     def trades(self):
@@ -174,40 +239,80 @@ class Backtest(object):
         print(yaml.dump(self.report, allow_unicode=True, default_flow_style=False))
         print('-' * len(s))
 
-    def plot_equity(self, subset=None, ax=None):
+    @staticmethod
+    def _plot_bins(ax):
+        """ Number of decimation buckets for axes: one per horizontal pixel. """
+        return max(int(ax.get_window_extent().width), 1)
+
+    def _plot_line(self, ax, series, decimate, **kwargs):
+        """
+        Plot series as line. If `decimate` is enabled, line is reduced to
+        min/max per pixel, and reduced again for visible range whenever axes
+        are zoomed or panned.
+        """
+        if not decimate:
+            return ax.plot(series.index, series.values, **kwargs)[0]
+        series = series.dropna()
+        part = pybacktest.parts.decimate(series, self._plot_bins(ax))
+        line, = ax.plot(part.index, part.values, **kwargs)
+        if isinstance(series.index, pandas.DatetimeIndex):
+            import matplotlib.dates
+            x = matplotlib.dates.date2num(series.index.values)
+        else:
+            x = numpy.asarray(series.index, dtype=float)
+
+        def redecimate(ax):
+            lo, hi = ax.get_xlim()
+            # keep one point beyond each edge, so line crosses them
+            a = max(numpy.searchsorted(x, lo) - 1, 0)
+            b = numpy.searchsorted(x, hi, side='right') + 1
+            part = pybacktest.parts.decimate(series.iloc[a:b],
+                                             self._plot_bins(ax))
+            line.set_data(part.index, part.values)
+
+        ax.callbacks.connect('xlim_changed', redecimate)
+        return line
+
+    def plot_equity(self, subset=None, ax=None, decimate=True):
+        """
+        Plot equity curve for `subset` (slice of bar positions or
+        timestamps).
+
+        With `decimate` enabled, curve is reduced to min/max per pixel of
+        axes width (and reduced again for visible range on zoom), so long
+        histories plot quickly while keeping drawdown extremes.
+        """
         import matplotlib.pylab as pylab
         _ = None
         if ax is None:
             _,ax = pylab.subplots()
-        
-        if subset is None:
-            subset = slice(None, None)
-        assert isinstance(subset, slice)
-        eq = self.equity[subset].cumsum()
-        
-        eq = self.equity.ix[subset].cumsum()
-        ix = eq.index
-        eq.plot(color='red', style='-',ax=ax)
-
-        #eq.plot(color='red', label='strategy',ax=ax)
-        #ix = self.ohlc.ix[eq.index[0]:eq.index[-1]].index
-        #price = self.ohlc.C
-        #(price[ix] - price[ix][0]).resample('W').first().dropna() \
-        #    .plot(color='black', alpha=0.5, label='underlying', ax=ax)
+
+        eq = pybacktest.parts.subset_of(self.equity, subset,
+                                        self.ohlc.index).cumsum()
+        self._plot_line(ax, eq, decimate, color='red', linestyle='-',
+                        label='strategy')
 
         ax.legend(loc='best')
         ax.set_title(str(self))
         ax.set_ylabel('Equity for %s' % subset)
         return _,ax
 
-    def plot_trades(self, subset=None, ax=None):
-        if subset is None:
-            subset = slice(None, None)
-        fr = self.trades.ix[subset]
-        le = fr.price[(fr.pos > 0) & (fr.vol > 0)]
-        se = fr.price[(fr.pos < 0) & (fr.vol < 0)]
-        lx = fr.price[(fr.pos.shift() > 0) & (fr.vol < 0)]
-        sx = fr.price[(fr.pos.shift() < 0) & (fr.vol > 0)]
+    def plot_trades(self, subset=None, ax=None, decimate=True):
+        """
+        Plot price with trade markers for `subset` (slice of bar positions or
+        timestamps). Trade markers are always drawn in full; price line is
+        decimated to min/max per pixel (of visible range) if `decimate` is
+        enabled.
+        """
+        fr = self.trades
+        pos = fr.pos.values
+        prev = fr.pos.shift().values
+        vol = fr.vol.values
+        ix = self.ohlc.index
+        le, se, lx, sx = [
+            pybacktest.parts.subset_of(fr.price[m], subset, ix)
+            for m in ((pos > 0) & (vol > 0), (pos < 0) & (vol < 0),
+                      (prev > 0) & (vol < 0), (prev < 0) & (vol > 0))]
 
         import matplotlib.pylab as pylab
         _ = None
@@ -222,7 +327,8 @@ class Backtest(object):
                    label='long exit')
         ax.plot(sx.index, sx.values, 'o', color='red', markersize=7,
                    label='short exit')
-        
-        self.ohlc.O.ix[subset].plot(color='black', label='price', ax=ax)
+
+        price = pybacktest.parts.subset_of(self.ohlc.O, subset, ix)
+        self._plot_line(ax, price, decimate, color='black', label='price')
         ax.set_ylabel('Trades for %s' % subset)
         return _,ax
@@ -0,0 +1,383 @@
+# coding: utf8
+
+# part of pybacktest package: https://github.com/ematvey/pybacktest
+
+""" Executor backends used to distribute Optimizer and verification tasks.
+
+All backends follow concurrent.futures.Executor interface:
+
+* `InlineExecutor` - runs tasks in this process, at submission time.
+* `concurrent.futures.ThreadPoolExecutor` - threads of this process.
+* `concurrent.futures.ProcessPoolExecutor` - local processes.
+* `RemoteExecutor` - workers on any number of hosts, connected over socket.
+
+To use `RemoteExecutor`, create it on master host and start workers on
+every node (strategy function has to be importable there), passing
+executor's `authkey` in environment:
+
+    PYBACKTEST_AUTHKEY=<authkey> python -m pybacktest.executors \
+        master-host:port [processes]
+
+"""
+
+import collections
+import concurrent.futures
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import socket
+import sys
+import threading
+import uuid
+
+
+__all__ = ['InlineExecutor', 'RemoteExecutor', 'WorkerLost', 'run_worker',
+           'get_executor', 'map_chunked']
+
+
+# chunks per sweep when chunksize is not given; more if there are many workers
+TARGET_CHUNKS = 100
+
+# how often map_chunked checks for newly connected workers, seconds
+POLL_INTERVAL = 0.5
+
+# number of map_chunked shared objects kept in each process
+SHARED_SLOTS = 2
+
+_shared = collections.OrderedDict()
+
+
+class WorkerLost(Exception):
+    """ Task was lost with its worker too many times. """
+
+
+class SharedDataMissing(Exception):
+    """ Worker has not received data shared by map_chunked yet. """
+
+
+class InlineExecutor(concurrent.futures.Executor):
+    """ Executor that runs every task in calling thread as it is submitted. """
+
+    _max_workers = 1
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class RemoteExecutor(concurrent.futures.Executor):
+    """
+    Executor serving tasks to workers connected over socket
+    (see `run_worker`). Each worker connection holds at most one task at a
+    time; if connection is lost mid-task, task is put back into queue and
+    handed to another worker, up to `retries` times (then it fails with
+    `WorkerLost`, so task crashing its workers can't hang executor).
+
+    `address` - (host, port) to listen on; port 0 picks free port, check
+    `address` attribute for actual one. Pass ('', port) or external
+    interface address to accept workers from other hosts.
+
+    `authkey` - shared secret, workers must use the same one. Random one is
+    generated if not given, read it from `authkey` attribute.
+
+    Note that anyone knowing authkey can execute code on master and workers,
+    so keep it secret and listen only on trusted networks.
+
+    """
+
+    def __init__(self, address=('127.0.0.1', 0), authkey=None, retries=2):
+        if authkey is None:
+            authkey = uuid.uuid4().hex.encode()
+        self.authkey = authkey
+        self.retries = retries
+        self._listener = multiprocessing.connection.Listener(
+            address, authkey=authkey)
+        self.address = self._listener.address
+        self._tasks = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._accepter = threading.Thread(target=self._accept)
+        self._accepter.daemon = True
+        self._accepter.start()
+
+    @property
+    def _max_workers(self):
+        return max(len(self._workers), 1)
+
+    def _accept(self):
+        while not self._shutdown:
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                # failed handshake, e.g. wrong authkey
+                continue
+            if self._shutdown:
+                conn.close()
+                break
+            t = threading.Thread(target=self._serve, args=(conn,))
+            t.daemon = True
+            with self._lock:
+                self._workers.add(t)
+            t.start()
+
+    def _serve(self, conn):
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    try:
+                        conn.send(None)
+                    except (OSError, EOFError):
+                        pass
+                    break
+                future, fn, args, kwargs, lost = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    conn.send((fn, args, kwargs))
+                    ok, value = conn.recv()
+                except (OSError, EOFError):
+                    # worker is gone, let someone else do the job
+                    self._requeue(future, fn, args, kwargs, lost + 1)
+                    break
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        finally:
+            conn.close()
+            with self._lock:
+                self._workers.discard(threading.current_thread())
+
+    def _requeue(self, future, fn, args, kwargs, lost):
+        if lost > self.retries:
+            future.set_exception(WorkerLost(
+                'Task was lost with worker %d times' % lost))
+            return
+        retry = concurrent.futures.Future()
+        retry.add_done_callback(functools.partial(_copy_future, future))
+        self._tasks.put((retry, fn, args, kwargs, lost))
+
+    def submit(self, fn, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        future = concurrent.futures.Future()
+        self._tasks.put((future, fn, args, kwargs, 0))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if cancel_futures:
+            while True:
+                try:
+                    task = self._tasks.get_nowait()
+                except queue.Empty:
+                    break
+                task[0].cancel()
+        self._shutdown = True
+        try:
+            # wake up accepting thread
+            socket.create_connection(self.address, timeout=1).close()
+        except OSError:
+            pass
+        self._listener.close()
+        with self._lock:
+            workers = list(self._workers)
+        for _ in workers:
+            self._tasks.put(None)
+        if wait:
+            for t in workers:
+                t.join()
+
+
+def _copy_future(target, source):
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _worker_loop(address, authkey):
+    conn = multiprocessing.connection.Client(address, authkey=authkey)
+    try:
+        while True:
+            try:
+                task = conn.recv()
+            except (OSError, EOFError):
+                break
+            if task is None:
+                break
+            fn, args, kwargs = task
+            try:
+                reply = (True, fn(*args, **kwargs))
+            except Exception as e:
+                reply = (False, e)
+            try:
+                conn.send(reply)
+            except (OSError, EOFError):
+                break
+            except Exception as e:
+                # result or exception is not picklable
+                conn.send((False, RuntimeError(repr(e))))
+    finally:
+        conn.close()
+
+
+def run_worker(address, authkey, processes=None):
+    """
+    Connect `processes` worker processes (default - one per core) to
+    `RemoteExecutor` listening at `address` and serve tasks until it shuts
+    down.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1:
+        _worker_loop(address, authkey)
+        return
+    procs = [multiprocessing.Process(target=_worker_loop,
+                                     args=(address, authkey))
+             for _ in range(processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+
+def get_executor(executor=None, processes=None):
+    """
+    Resolve executor specification into (executor, owned) pair, where
+    `owned` means caller is responsible for shutting executor down.
+
+    `executor` - Executor instance (used as is), one of 'inline', 'thread',
+    'process', or None to choose by `processes` (1 - inline, otherwise
+    process pool with `processes` processes, None meaning one per core).
+
+    """
+    if isinstance(executor, concurrent.futures.Executor):
+        return executor, False
+    if executor is None:
+        executor = 'inline' if processes == 1 else 'process'
+    if executor == 'inline':
+        return InlineExecutor(), True
+    elif executor == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(processes), True
+    elif executor == 'process':
+        return concurrent.futures.ProcessPoolExecutor(processes), True
+    raise ValueError("Unknown executor '%s'" % executor)
+
+
+def _share(token, obj):
+    _shared[token] = obj
+    while len(_shared) > SHARED_SLOTS:
+        _shared.popitem(last=False)
+
+
+def _run_chunk(fn, chunk, token=None, *data):
+    if token is None:
+        return [fn(x) for x in chunk]
+    if data:
+        _share(token, data[0])
+    if token not in _shared:
+        raise SharedDataMissing(token)
+    obj = _shared[token]
+    return [fn(obj, x) for x in chunk]
+
+
+def map_chunked(executor, fn, items, chunksize=None, retries=2,
+                callback=None, shared=None):
+    """
+    Apply `fn` to every element of `items` using `executor`, sending them in
+    chunks of `chunksize` to amortize dispatch overhead. Failed chunks are
+    resubmitted up to `retries` times before exception is propagated.
+    Results are returned as list in order of `items`.
+
+    By default, items are split into about `TARGET_CHUNKS` chunks (or four
+    per worker, if there are more workers). Number of chunks in flight
+    follows current number of executor's workers.
+
+    `callback`, if given, is called with number of completed items after
+    each chunk.
+
+    `shared`, if given, is passed to `fn` as first argument. It is sent to
+    each worker process only once (when its first chunk finds it missing),
+    not with every chunk.
+
+    """
+    def workers():
+        # may change while running, e.g. when remote workers connect
+        return getattr(executor, '_max_workers', None) or \
+            multiprocessing.cpu_count()
+
+    items = list(items)
+    if chunksize is None:
+        chunksize = max(1, -(-len(items) // max(workers() * 4,
+                                                TARGET_CHUNKS)))
+    chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+    results = [None] * len(chunks)
+    attempts = [0] * len(chunks)
+    pending = {}
+    todo = iter(range(len(chunks)))
+    completed = 0
+    token = None
+    if shared is not None:
+        token = uuid.uuid4().hex
+        _share(token, shared)
+
+    def submit(n, send_shared=False):
+        args = (fn, chunks[n])
+        if token is not None:
+            args += (token, shared) if send_shared else (token,)
+        pending[executor.submit(_run_chunk, *args)] = n
+
+    try:
+        while True:
+            for n in itertools.islice(
+                    todo, max(workers() * 2 - len(pending), 0)):
+                submit(n)
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(
+                pending, timeout=POLL_INTERVAL,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                n = pending.pop(future)
+                try:
+                    results[n] = future.result()
+                except SharedDataMissing:
+                    submit(n, send_shared=True)
+                    continue
+                except Exception:
+                    if attempts[n] >= retries:
+                        raise
+                    attempts[n] += 1
+                    submit(n)
+                    continue
+                completed += len(chunks[n])
+                if callback is not None:
+                    callback(completed)
+    finally:
+        for future in pending:
+            future.cancel()
+        _shared.pop(token, None)
+    return list(itertools.chain.from_iterable(results))
+
+
+if __name__ == '__main__':
+    host, port = sys.argv[1].rsplit(':', 1)
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    authkey = os.environ.get('PYBACKTEST_AUTHKEY')
+    if not authkey:
+        sys.exit('PYBACKTEST_AUTHKEY environment variable is not set')
+    run_worker((host, int(port)), authkey.encode(), processes)
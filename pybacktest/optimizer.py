@@ -6,15 +6,17 @@
 
 from cached_property import cached_property
 from pybacktest.backtest import Backtest
+import pybacktest.ami_funcs
+import pybacktest.executors
 
+import functools
 import itertools
 import pandas
 import numpy
-import multiprocessing
 
 
-def _embedded_backtest(args_tuple):
-    params, strategy_fn, ohlc, metrics = args_tuple
+def _embedded_backtest(strategy_fn, metrics, cache_bytes, ohlc, params):
+    pybacktest.ami_funcs.indicator_cache.maxbytes = cache_bytes
     bt = Backtest(strategy_fn(ohlc, **params))
     r = {}
     for m in metrics:
@@ -27,7 +29,8 @@ class Optimizer(object):
 
     def __init__(self, strategy_fn, ohlc, params={},
                  metrics=['pf', 'sharpe', 'maxdd', 'mpi', 'average', 'trades'],
-                 processes=None):
+                 processes=None, executor=None, chunksize=None, retries=2,
+                 cache_bytes=None):
         ''' `strategy_fn` - Backtest-compatible strategy function.
 
         `ohlc` - Backtest- and strategy-compatible dataframe.
@@ -37,6 +40,22 @@ class Optimizer(object):
         `processes` - pass 1 to use single (this) process, pass None to use
         #processes = #cores, or specify exact number of processes to use.
 
+        `executor` - concurrent.futures-compatible executor to run backtests
+        on (e.g. `pybacktest.executors.RemoteExecutor` to spread them across
+        hosts), or one of 'inline', 'thread', 'process'. Overrides
+        `processes` if given.
+
+        `chunksize` - number of parameter sets sent to executor at once
+        (by default, picked from number of workers).
+
+        `retries` - number of times failed chunk is resubmitted.
+
+        `cache_bytes` - size limit of memoized indicators cache (see
+        `pybacktest.ami_funcs.indicator_cache`) in every worker. By default,
+        it is large enough to keep two indicators for each value of every
+        parameter, so whole sweep computes each of them once. Note that with
+        inline executor limit is set in this process.
+
         '''
         self.strategy_fn = strategy_fn
         self.ohlc = ohlc
@@ -44,6 +63,10 @@ class Optimizer(object):
         assert all([len(p) == 3 for p in list(params.values())]), 'Wrong params specified'
         self.params = params.copy()
         self.processes = processes
+        self.executor = executor
+        self.chunksize = chunksize
+        self.retries = retries
+        self.cache_bytes = cache_bytes
 
     def add_param(self, param, start, stop, step):
         self.params[param] = [start, stop, step]
@@ -52,30 +75,30 @@ class Optimizer(object):
     def results(self):
         p = self.params
         pn = list(p.keys())
-        results = []
-        param_space = [
-            dict(list(zip(pn, pset))) for pset in
-            itertools.product(
-                *[numpy.arange(p[k][0], p[k][1]+.000001, p[k][2]) for k in pn]
-            )
-        ]
-
-        args_gen = zip(param_space,
-                                  itertools.repeat(self.strategy_fn),
-                                  itertools.repeat(self.ohlc),
-                                  itertools.repeat(self.metrics))
-
-        if self.processes != 1:
-            pool = multiprocessing.Pool(self.processes)
-            try:
-                results = pool.map(_embedded_backtest, args_gen)
-            except KeyboardInterrupt:
-                pool.close()
-                pool.join()
-        else:
-            results = []
-            for a in args_gen:
-                results.append(_embedded_backtest(a))
+        values = [numpy.arange(p[k][0], p[k][1]+.000001, p[k][2]) for k in pn]
+        param_space = [dict(list(zip(pn, pset)))
+                       for pset in itertools.product(*values)]
+
+        cache_bytes = self.cache_bytes
+        if cache_bytes is None:
+            bars = len(self.ohlc) * 8
+            cache_bytes = max(pybacktest.ami_funcs.CACHE_BYTES,
+                              2 * sum(map(len, values)) * bars +
+                              int(self.ohlc.memory_usage().sum()))
+
+        # ohlc is sent to each worker once and then kept there, so memoized
+        # indicators computed on it stay valid across tasks
+        fn = functools.partial(_embedded_backtest, self.strategy_fn,
+                               self.metrics, cache_bytes)
+        executor, owned = pybacktest.executors.get_executor(self.executor,
+                                                            self.processes)
+        try:
+            results = pybacktest.executors.map_chunked(
+                executor, fn, param_space, self.chunksize, self.retries,
+                shared=self.ohlc)
+        finally:
+            if owned:
+                executor.shutdown()
 
         return pandas.DataFrame(results)
 
@@ -7,6 +7,9 @@ Usable both in backtesting and production.
 
 """
 
+import numbers
+
+import numpy
 import pandas
 
 
@@ -38,6 +41,132 @@ def signals_to_positions(signals, init_pos=0,
     return ps[ps != ps.shift()]
 
 
+def _stop_hit(side, entry, peak, o, h, l, stop_loss, take_profit,
+              trailing_stop, percent):
+    """
+    Find first of bars `o`, `h`, `l` where stop is triggered for position
+    entered at `entry`, `peak` being best price (highest high for long,
+    lowest low for short) since entry up to these bars. Returns
+    (offset, fill price) or None, and peak updated with these bars.
+    """
+    if side < 0:
+        # mirror short position into long one
+        entry, peak, o, h, l = -entry, -peak, -o, -l, -h
+    dist = (lambda v, ref: v * abs(ref)) if percent else (lambda v, ref: v)
+    peaks = numpy.fmax.accumulate(numpy.append(peak, h))
+    level = numpy.full(len(o), -numpy.inf)
+    if stop_loss is not None:
+        level = numpy.maximum(level, entry - dist(stop_loss, entry))
+    if trailing_stop is not None:
+        level = numpy.maximum(level, peaks[:-1] - dist(trailing_stop,
+                                                       peaks[:-1]))
+    hit_stop = l <= level
+    hit = hit_stop
+    if take_profit is not None:
+        target = entry + dist(take_profit, entry)
+        hit = hit | (h >= target)
+    if not hit.any():
+        return None, peaks[-1] * side
+    j = hit.argmax()
+    # if both stop and target are within bar, assume stop came first
+    fill = min(o[j], level[j]) if hit_stop[j] else max(o[j], target)
+    return (j, fill * side), peaks[-1] * side
+
+
+def signals_to_positions_with_stops(signals, ohlc, price, stop_loss=None,
+                                    take_profit=None, trailing_stop=None,
+                                    stop_type='point',
+                                    mask=('Buy', 'Sell', 'Short', 'Cover')):
+    """
+    Translate signal dataframe into positions series, closing positions on
+    stop-loss, take-profit and trailing-stop hits. Stop distances are in
+    price points or, with `stop_type='percent'`, in fractions of price.
+
+    Position is entered at `price` of bar following entry signal; stops are
+    checked against `ohlc` H/L starting from next bar, and filled at stop
+    level (or open price if it gaps through). Exit signal closes whole
+    position, unless entry signal of the same side comes on the same bar:
+    then position is kept, and stops are still measured from original
+    entry.
+
+    Returns positions series (as `signals_to_positions`) and series of stop
+    fill prices indexed by bars where stop was hit.
+    """
+    if stop_type not in ('point', 'percent'):
+        raise ValueError("Unknown stop type '%s'" % stop_type)
+    long_en, long_ex, short_en, short_ex = mask
+    n = len(signals)
+    ix = signals.index
+    o, h, l = [ohlc[c].reindex(ix).values.astype(float) for c in 'OHL']
+    pr = price.reindex(ix).values.astype(float)
+    sig = dict([(c, signals[c].values) for c in mask])
+
+    def next_signal(col):
+        # position of next signal at or after each bar (n if there is none)
+        at = numpy.where(sig[col].astype(bool), numpy.arange(n), n)
+        return numpy.append(numpy.minimum.accumulate(at[::-1])[::-1], n)
+
+    nxt = dict([(c, next_signal(c)) for c in mask])
+    pos_ix, pos_val = [0], [0.]
+    fill_ix, fill_val = [], []
+    i = 0
+    while i < n:
+        # entry, as in signals_to_positions long has priority
+        side = 1 if nxt[long_en][i] <= nxt[short_en][i] else -1
+        en, ex = (long_en, long_ex) if side > 0 else (short_en, short_ex)
+        e = nxt[en][i]
+        if e >= n:
+            break
+        pos_ix.append(e)
+        pos_val.append(side * float(sig[en][e]))
+        if e + 1 >= n:
+            break
+        entry = pr[e + 1]
+        peak = (numpy.fmax if side > 0 else numpy.fmin)(
+            entry, (h if side > 0 else l)[e + 1])
+        start, after, hit = e + 2, e + 1, None
+        while True:
+            x = nxt[ex][after]
+            end = min(x, n - 1) + 1
+            # look for stops in growing windows, so that work done is
+            # proportional to position duration
+            window = 16
+            while start < end and hit is None:
+                stop = min(start + window, end)
+                hit, peak = _stop_hit(
+                    side, entry, peak, o[start:stop], h[start:stop],
+                    l[start:stop], stop_loss, take_profit, trailing_stop,
+                    stop_type == 'percent')
+                if hit is not None:
+                    hit = (start + hit[0], hit[1])
+                start, window = stop, window * 2
+            if hit is not None or x >= n:
+                break
+            # exit and same-side entry on one bar keep position open
+            if not sig[en][x] or (side < 0 and sig[long_en][x]):
+                break
+            pos_ix.append(x)
+            pos_val.append(side * float(sig[en][x]))
+            after = x + 1
+        if hit is not None:
+            k = hit[0]
+            pos_ix.append(k - 1)
+            pos_val.append(0.)
+            fill_ix.append(k)
+            fill_val.append(hit[1])
+            i = k
+        elif x < n:
+            pos_ix.append(x)
+            pos_val.append(0.)
+            i = x
+        else:
+            break
+    ps = pandas.Series(pos_val, index=ix[pos_ix])
+    ps = ps[~ps.index.duplicated(keep='last')]
+    fills = pandas.Series(fill_val, index=ix[fill_ix], dtype=float)
+    return ps[ps != ps.shift()], fills
+
+
 def trades_to_equity(trd):
     """
     Convert trades dataframe (cols [vol, price, pos]) to equity diff series
@@ -74,6 +203,56 @@ def extract_frame(dataobj, ext_mask, int_mask):
     return None
 
 
+def subset_of(obj, subset=None, index=None):
+    """
+    Select `subset` of series or dataframe. Integer (or open) slices are
+    treated as positional, anything else is passed to `.loc`.
+
+    If `index` is given, positional slices refer to it (e.g. bars) and are
+    translated to timestamps, so sparse objects like trades are cut to the
+    same time range. Slice step is not supported then.
+    """
+    if subset is None:
+        return obj
+    if isinstance(subset, slice) and all(
+            x is None or isinstance(x, numbers.Integral)
+            for x in (subset.start, subset.stop, subset.step)):
+        if index is None:
+            return obj.iloc[subset]
+        if subset.step not in (None, 1):
+            raise ValueError('Slice step is not supported for %s' % subset)
+        labels = index[slice(subset.start, subset.stop)]
+        if len(labels) == 0:
+            return obj.iloc[0:0]
+        return obj.loc[labels[0]:labels[-1]]
+    return obj.loc[subset]
+
+
+def decimate(series, bins):
+    """
+    Downsample series for plotting by keeping only minimum and maximum value
+    in each of `bins` equal-sized buckets (plus first and last points), so
+    extremes (e.g. drawdowns) survive. Returns series unchanged if it is
+    already short enough.
+    """
+    series = series.dropna()
+    n = len(series)
+    if not bins or n <= 2 * bins:
+        return series
+    v = series.values
+    starts = numpy.linspace(0, n, bins + 1).astype(int)[:-1]
+    bucket = numpy.repeat(numpy.arange(bins), numpy.diff(numpy.append(starts, n)))
+    pos = numpy.arange(n)
+    imin = numpy.minimum.reduceat(
+        numpy.where(v == numpy.minimum.reduceat(v, starts)[bucket], pos, n),
+        starts)
+    imax = numpy.minimum.reduceat(
+        numpy.where(v == numpy.maximum.reduceat(v, starts)[bucket], pos, n),
+        starts)
+    keep = numpy.unique(numpy.concatenate([[0, n - 1], imin, imax]))
+    return series.iloc[keep]
+
+
 class Slicer(object):
     def __init__(self, target, obj):
         self.target = target
@@ -1,6 +1,9 @@
+import functools
+import itertools
 import pandas
 import sys
 from pybacktest.backtest import Backtest
+import pybacktest.executors
 
 
 def iter_verify(strategy_fn, data, window_size):
@@ -35,30 +38,57 @@ def iter_verify(strategy_fn, data, window_size):
         print('valid')
 
 
-def frontal_iterative_signals(strategy_fn, data, window_size, verbose=True):
-    front = []
-    p_prg = None
-    for i in range(window_size, len(data)):
-        data_subset = data.iloc[i - window_size : i]
-        last_sig = Backtest(strategy_fn(data_subset)).signals.iloc[-1]
-        front.append(last_sig)
-        if verbose:
-            prg = round(((float(i) - window_size) / (len(data) - window_size)) * 100, 1)
-            if p_prg != prg:
-                sys.stdout.write(' \r%s%% done' % prg)
-                sys.stdout.flush()
-                p_prg = prg
-    return pandas.DataFrame(front)
+def _last_signals(strategy_fn, window_size, data):
+    # last signals of every window of `data`, except incomplete ones
+    return [Backtest(strategy_fn(data.iloc[i - window_size : i])).signals.iloc[-1]
+            for i in range(window_size, len(data) + 1)]
+
+
+def frontal_iterative_signals(strategy_fn, data, window_size, verbose=True,
+                              executor=None, processes=1, chunksize=None,
+                              retries=2):
+    total = len(data) - window_size
+    progress = {'prev': None}
+    if chunksize is None:
+        chunksize = max(1, -(-total // pybacktest.executors.TARGET_CHUNKS))
 
+    def report(completed):
+        completed = min(completed * chunksize, total)
+        prg = round((float(completed) / total) * 100, 1)
+        if progress['prev'] != prg:
+            sys.stdout.write(' \r%s%% done' % prg)
+            sys.stdout.flush()
+            progress['prev'] = prg
+
+    # each chunk gets only bars its windows cover
+    chunks = [data.iloc[i - window_size : min(i + chunksize, len(data)) - 1]
+              for i in range(window_size, len(data), chunksize)]
+    fn = functools.partial(_last_signals, strategy_fn, window_size)
+    executor, owned = pybacktest.executors.get_executor(executor, processes)
+    try:
+        front = pybacktest.executors.map_chunked(
+            executor, fn, chunks, 1, retries,
+            callback=report if verbose else None)
+    finally:
+        if owned:
+            executor.shutdown()
+    return pandas.DataFrame(list(itertools.chain.from_iterable(front)))
 
-def verify(strategy_fn, data, window_size, verbose=True):
+
+def verify(strategy_fn, data, window_size, verbose=True, executor=None,
+           processes=1, chunksize=None, retries=2):
     """
     Verify vectorized pandas backtest iteratively by running it
     in sliding window, bar-by-bar.
+
+    Windows are evaluated on `executor` (see `Optimizer` for accepted values
+    of `executor`, `processes` and `retries`), `chunksize` windows per task;
+    by default, in this process.
     """
-    fsig = frontal_iterative_signals(strategy_fn, data, window_size, verbose)
+    fsig = frontal_iterative_signals(strategy_fn, data, window_size, verbose,
+                                     executor, processes, chunksize, retries)
     bsig = Backtest(strategy_fn(data)).signals.reindex(fsig.index)
-    comp = fsig.ix[(fsig == bsig).T.all() == False]
+    comp = fsig.loc[(fsig == bsig).T.all() == False]
     if len(comp) != 0:
         if verbose:
             sys.stdout.write('\rverification did not pass\nreturning dataframe with mismatches')
@@ -0,0 +1,103 @@
+import numpy
+import pandas
+import pytest
+
+import pybacktest.ami_funcs
+from pybacktest import Optimizer
+from pybacktest.ami_funcs import (MA, EMA, HHV, LLV, ATR, Cross,
+                                  indicator_cache)
+
+
+@pytest.fixture
+def ohlc():
+    rs = numpy.random.RandomState(0)
+    c = 100 + rs.randn(500).cumsum()
+    return pandas.DataFrame({'O': c, 'H': c + 1, 'L': c - 1, 'C': c},
+                            index=pandas.date_range('2020', periods=500,
+                                                    freq='h'))
+
+
+@pytest.fixture(autouse=True)
+def cache():
+    maxbytes = indicator_cache.maxbytes
+    indicator_cache.clear()
+    yield indicator_cache
+    indicator_cache.maxbytes = maxbytes
+    indicator_cache.clear()
+
+
+def test_indicators_match_pandas(ohlc):
+    pandas.testing.assert_series_equal(MA(ohlc.C, 10),
+                                       ohlc.C.rolling(10).mean())
+    pandas.testing.assert_series_equal(
+        EMA(ohlc.C, 10), ohlc.C.ewm(span=10, adjust=False).mean())
+    pandas.testing.assert_series_equal(HHV(ohlc.H, 5), ohlc.H.rolling(5).max())
+    pandas.testing.assert_series_equal(LLV(ohlc.L, 5), ohlc.L.rolling(5).min())
+    up = Cross(ohlc.C, 100)
+    assert (ohlc.C[up] > 100).all() and (ohlc.C.shift()[up] <= 100).all()
+
+
+def test_atr_matches_wilder_smoothing(ohlc):
+    rs = numpy.random.RandomState(1)
+    ohlc = ohlc.assign(H=ohlc.C + rs.rand(len(ohlc)) * 2,
+                       L=ohlc.C - rs.rand(len(ohlc)) * 2,
+                       C=ohlc.C + rs.randn(len(ohlc)))
+    h, l, c = ohlc.H.values, ohlc.L.values, ohlc.C.values
+    atr = [h[0] - l[0]]
+    for t in range(1, len(ohlc)):
+        tr = max(h[t] - l[t], abs(h[t] - c[t - 1]), abs(l[t] - c[t - 1]))
+        atr.append(atr[-1] + (tr - atr[-1]) / 14.)
+    numpy.testing.assert_allclose(ATR(ohlc, 14).values, atr)
+
+
+def test_keyword_arguments(ohlc, cache):
+    pandas.testing.assert_series_equal(MA(ohlc.C, periods=10),
+                                       ohlc.C.rolling(10).mean())
+    EMA(array=ohlc.C, periods=5)
+    EMA(ohlc.C, 5)
+    ATR(ohlc=ohlc, periods=14)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_cache_reuses_windows_of_same_input(ohlc, cache):
+    MA(ohlc.C, 10)
+    MA(ohlc.C, 10.0)
+    MA(ohlc.C, 20)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_is_bounded_by_bytes(ohlc, cache):
+    # shared input is accounted once
+    cache.maxbytes = 4 * ohlc.C.nbytes
+    for w in range(2, 12):
+        MA(ohlc.C, w)
+    assert len(cache) == 3
+    assert cache.nbytes == cache.maxbytes
+    cache.maxbytes = 2 * ohlc.C.nbytes
+    MA(ohlc.H, 2)
+    assert len(cache) == 1
+    assert cache.nbytes == cache.maxbytes
+
+
+def crossover(ohlc, fast, slow):
+    ms, ml = MA(ohlc.C, fast), MA(ohlc.C, slow)
+    buy = cover = (ms > ml) & (ms.shift() < ml.shift())
+    sell = short = (ms < ml) & (ms.shift() > ml.shift())
+    return locals()
+
+
+def test_optimizer_sweep_computes_each_window_once(cache, monkeypatch):
+    rs = numpy.random.RandomState(0)
+    c = pandas.Series(100 + rs.randn(2000).cumsum(),
+                      index=pandas.date_range('2020', periods=2000,
+                                              freq='min'))
+    ohlc = pandas.DataFrame({'O': c, 'H': c + 1, 'L': c - 1, 'C': c})
+    # too small for the grid unless sized by Optimizer
+    monkeypatch.setattr(pybacktest.ami_funcs, 'CACHE_BYTES', c.nbytes)
+    opt = Optimizer(crossover, ohlc, params=dict(fast=[2, 8, 2],
+                                                 slow=[20, 115, 5]),
+                    metrics=['trades'], processes=1)
+    assert len(opt.results) == 4 * 20
+    # every window computed once: 4 fast + 20 slow
+    assert cache.misses == 24
+    assert cache.hits == 2 * 80 - 24
@@ -0,0 +1,145 @@
+import concurrent.futures
+import operator
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from pybacktest.executors import (InlineExecutor, RemoteExecutor,
+                                  WorkerLost, map_chunked)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_calls = []
+
+
+def _flaky(x):
+    # fails on second call only
+    _calls.append(x)
+    if len(_calls) == 2:
+        raise ValueError('flaky')
+    return x * 2
+
+
+def _broken(x):
+    raise ZeroDivisionError
+
+
+def _count_shared_sends(executor):
+    # count tasks submitted together with shared data
+    sends = []
+    submit = executor.submit
+
+    def counting_submit(fn, *args):
+        sends.append(len(args) == 4)
+        return submit(fn, *args)
+
+    executor.submit = counting_submit
+    return sends
+
+
+def _start_worker(executor):
+    env = dict(os.environ, PYBACKTEST_AUTHKEY=executor.authkey.decode())
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    return subprocess.Popen(
+        [sys.executable, '-m', 'pybacktest.executors',
+         '%s:%d' % executor.address, '1'], env=env)
+
+
+def _wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def remote():
+    executor = RemoteExecutor()
+    workers = []
+    yield executor, workers
+    executor.shutdown(wait=False, cancel_futures=True)
+    for w in workers:
+        w.kill()
+        w.wait()
+
+
+def test_map_chunked_retries_failed_chunk():
+    del _calls[:]
+    assert map_chunked(InlineExecutor(), _flaky, range(10), chunksize=3,
+                       retries=1) == [x * 2 for x in range(10)]
+
+
+def test_map_chunked_raises_when_retries_exhausted():
+    with pytest.raises(ZeroDivisionError):
+        map_chunked(InlineExecutor(), _broken, range(3), retries=1)
+
+
+def test_map_chunked_passes_shared_data():
+    assert map_chunked(InlineExecutor(), operator.add, range(5),
+                       shared=10) == list(range(10, 15))
+
+
+def test_shared_data_is_not_sent_with_every_chunk():
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        sends = _count_shared_sends(executor)
+        assert map_chunked(executor, operator.add, range(40), chunksize=2,
+                           shared=10) == list(range(10, 50))
+    assert len(sends) >= 20
+    assert sum(sends) <= 2
+
+
+def test_remote_executor_sends_shared_data_once_per_worker(remote):
+    executor, workers = remote
+    workers.extend(_start_worker(executor) for _ in range(2))
+    sends = _count_shared_sends(executor)
+    assert map_chunked(executor, operator.add, range(40), chunksize=2,
+                       shared=10) == list(range(10, 50))
+    assert len(sends) >= 20
+    assert 1 <= sum(sends) <= 4
+
+
+def test_remote_executor_maps_in_order(remote):
+    executor, workers = remote
+    workers.extend(_start_worker(executor) for _ in range(2))
+    assert map_chunked(executor, abs, range(-50, 0), chunksize=3) == \
+        list(range(50, 0, -1))
+
+
+def test_remote_executor_requeues_task_of_killed_worker(remote):
+    executor, workers = remote
+    workers.append(_start_worker(executor))
+    future = executor.submit(time.sleep, 1)
+    _wait_for(future.running)
+    workers[0].kill()
+    workers[0].wait()
+    workers.append(_start_worker(executor))
+    assert future.result(timeout=30) is None
+    assert executor.submit(os.getpid).result(timeout=30) == workers[1].pid
+
+
+def test_remote_executor_gives_up_on_task_killing_workers():
+    executor = RemoteExecutor(retries=1)
+    workers = [_start_worker(executor) for _ in range(3)]
+    try:
+        future = executor.submit(os._exit, 1)
+        assert isinstance(future.exception(timeout=60), WorkerLost)
+        _wait_for(lambda: sum(w.poll() is not None for w in workers) == 2)
+        assert executor.submit(abs, -1).result(timeout=30) == 1
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        for w in workers:
+            w.kill()
+            w.wait()
+
+
+def test_remote_executor_rejects_wrong_authkey(remote):
+    executor, workers = remote
+    executor.authkey, authkey = b'wrong', executor.authkey
+    workers.append(_start_worker(executor))
+    assert workers[0].wait(timeout=30) != 0
+    executor.authkey = authkey
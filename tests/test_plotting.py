@@ -0,0 +1,93 @@
+import numpy
+import pandas
+import pytest
+
+from pybacktest import Backtest
+from pybacktest.parts import decimate, subset_of
+
+
+@pytest.fixture(scope='module')
+def bt():
+    rs = numpy.random.RandomState(0)
+    c = pandas.Series(100 + rs.randn(5000).cumsum(),
+                      index=pandas.date_range('2020', periods=5000, freq='h'))
+    ohlc = pandas.DataFrame({'O': c, 'H': c + 1, 'L': c - 1, 'C': c})
+    ms, ml = c.rolling(10).mean(), c.rolling(50).mean()
+    buy = cover = (ms > ml) & (ms.shift() < ml.shift())
+    sell = short = (ms < ml) & (ms.shift() > ml.shift())
+    return Backtest(locals())
+
+
+def test_decimate_keeps_extremes_of_each_bucket():
+    s = pandas.Series(numpy.random.RandomState(0).randn(1000))
+    d = decimate(s, 10)
+    assert len(d) <= 2 * 10 + 2
+    assert d.index[0] == 0 and d.index[-1] == 999
+    starts = numpy.linspace(0, 1000, 11).astype(int)
+    for a, b in zip(starts[:-1], starts[1:]):
+        bucket = s.iloc[a:b]
+        assert bucket.idxmin() in d.index and bucket.idxmax() in d.index
+
+
+def test_decimate_passes_short_series_through():
+    s = pandas.Series(numpy.arange(20.))
+    assert decimate(s, 10).equals(s)
+    assert decimate(s, None).equals(s)
+
+
+def test_decimate_drops_nans():
+    s = pandas.Series(numpy.random.RandomState(1).randn(1000))
+    s.iloc[::7] = numpy.nan
+    d = decimate(s, 10)
+    assert d.notnull().all()
+    assert d.min() == s.min() and d.max() == s.max()
+
+
+@pytest.mark.parametrize('subset', [slice(100, 3000), slice(-1000, None),
+                                    slice(None, 200)])
+def test_positional_subset_cuts_sparse_frames_by_bars(bt, subset):
+    bars = bt.ohlc.index[subset]
+    for obj in (bt.trades, bt.equity):
+        sub = subset_of(obj, subset, bt.ohlc.index)
+        assert len(sub) < len(obj)
+        assert sub.equals(obj[(obj.index >= bars[0]) &
+                              (obj.index <= bars[-1])])
+
+
+def test_timestamp_subset(bt):
+    subset = slice('2020-02-01', '2020-03-01')
+    assert subset_of(bt.trades, subset, bt.ohlc.index).equals(
+        bt.trades.loc[subset])
+
+
+def test_subset_rejects_step(bt):
+    with pytest.raises(ValueError):
+        subset_of(bt.equity, slice(None, None, 10), bt.ohlc.index)
+
+
+def test_trade_markers_match_zoomed_range(bt):
+    pytest.importorskip('matplotlib')
+    import matplotlib
+    matplotlib.use('Agg')
+    _, ax = bt.trdplot[100:3000]
+    lo, hi = bt.ohlc.index[100], bt.ohlc.index[2999]
+    for line in ax.get_lines():
+        x = pandas.DatetimeIndex(line.get_xdata())
+        assert len(x) and x.min() >= lo and x.max() <= hi
+
+
+def test_toolbar_zoom_redecimates_visible_range(bt):
+    pytest.importorskip('matplotlib')
+    import matplotlib
+    import matplotlib.dates
+    matplotlib.use('Agg')
+    _, ax = bt.plot_trades()
+    price = ax.get_lines()[-1]
+    full = len(price.get_xdata())
+    assert full < len(bt.ohlc)
+    lo, hi = bt.ohlc.index[1000], bt.ohlc.index[1300]
+    ax.set_xlim(matplotlib.dates.date2num(lo), matplotlib.dates.date2num(hi))
+    x = pandas.DatetimeIndex(price.get_xdata())
+    # all bars of visible range, plus one beyond each edge
+    assert len(x) == 303
+    assert x[0] == bt.ohlc.index[999] and x[-1] == bt.ohlc.index[1301]
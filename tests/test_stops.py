@@ -0,0 +1,203 @@
+import itertools
+
+import numpy
+import pandas
+import pytest
+
+from pybacktest import Backtest, Optimizer
+from pybacktest.parts import signals_to_positions_with_stops
+
+
+MASK = ('Buy', 'Sell', 'Short', 'Cover')
+
+
+def make_bars(n, seed):
+    rs = numpy.random.RandomState(seed)
+    c = 100 + rs.randn(n).cumsum()
+    # occasional gaps between close and next open
+    o = numpy.append(100, c[:-1]) + rs.randn(n) * numpy.where(
+        rs.rand(n) < 0.05, 3, 0.2)
+    return pandas.DataFrame(
+        {'O': o, 'H': numpy.maximum(o, c) + abs(rs.randn(n)),
+         'L': numpy.minimum(o, c) - abs(rs.randn(n)), 'C': c},
+        index=pandas.date_range('2020', periods=n, freq='h'))
+
+
+def make_signals(ohlc, seed):
+    rs = numpy.random.RandomState(seed)
+    n = len(ohlc)
+    sig = pandas.DataFrame(rs.rand(n, 4) < 0.04, index=ohlc.index,
+                           columns=list(MASK))
+    # exit and entry of the same side on one bar
+    both = rs.rand(n) < 0.02
+    sig.loc[both, ['Sell', 'Buy']] = True
+    both = rs.rand(n) < 0.02
+    sig.loc[both, ['Cover', 'Short']] = True
+    return sig
+
+
+def reference(signals, ohlc, price, stop_loss=None, take_profit=None,
+              trailing_stop=None, percent=False):
+    """ Straightforward bar-by-bar simulation of stops. """
+    n = len(signals)
+    o, h, l = ohlc.O.values, ohlc.H.values, ohlc.L.values
+    pr = price.values
+    buy, sell, short, cover = [signals[c].values for c in MASK]
+    dist = (lambda v, ref: v * abs(ref)) if percent else (lambda v, ref: v)
+    out = numpy.zeros(n)
+    fills = {}
+    pos, entry, peak, held = 0., None, None, n
+    for t in range(n):
+        if pos > 0 and t > held:
+            level = -numpy.inf
+            if stop_loss is not None:
+                level = max(level, entry - dist(stop_loss, entry))
+            if trailing_stop is not None:
+                level = max(level, peak - dist(trailing_stop, peak))
+            target = None if take_profit is None else \
+                entry + dist(take_profit, entry)
+            if l[t] <= level:
+                fills[t] = min(o[t], level)
+            elif target is not None and h[t] >= target:
+                fills[t] = max(o[t], target)
+        elif pos < 0 and t > held:
+            level = numpy.inf
+            if stop_loss is not None:
+                level = min(level, entry + dist(stop_loss, entry))
+            if trailing_stop is not None:
+                level = min(level, peak + dist(trailing_stop, peak))
+            target = None if take_profit is None else \
+                entry - dist(take_profit, entry)
+            if h[t] >= level:
+                fills[t] = max(o[t], level)
+            elif target is not None and l[t] <= target:
+                fills[t] = min(o[t], target)
+        if t in fills:
+            pos = 0.
+            out[t - 1] = 0.
+        if pos > 0 and t >= held:
+            peak = max(peak, h[t])
+        elif pos < 0 and t >= held:
+            peak = min(peak, l[t])
+
+        prev = pos
+        if pos > 0 and sell[t]:
+            pos = 0.
+        elif pos < 0 and cover[t]:
+            pos = 0.
+        if pos == 0:
+            if buy[t]:
+                pos = float(buy[t])
+            elif short[t]:
+                pos = -float(short[t])
+            if pos * prev <= 0 and pos != 0:
+                # new position, not continuation of previous one
+                held = t + 1
+                if held < n:
+                    entry = peak = pr[held]
+        out[t] = pos
+    ps = pandas.Series(out, index=signals.index)
+    return ps[ps != ps.shift()], fills
+
+
+STOPS = [
+    dict(stop_loss=1.5),
+    dict(take_profit=2.),
+    dict(trailing_stop=1.),
+    dict(stop_loss=2., take_profit=3.),
+    dict(stop_loss=3., take_profit=4., trailing_stop=1.5),
+]
+
+
+@pytest.mark.parametrize('stops,percent,seed', [
+    (stops, percent, seed) for stops, percent, seed in
+    itertools.product(STOPS, (False, True), (0, 1))])
+def test_stops_match_bar_by_bar_reference(stops, percent, seed):
+    ohlc = make_bars(1500, seed)
+    signals = make_signals(ohlc, seed + 100)
+    if percent:
+        stops = dict([(k, v / 100.) for k, v in stops.items()])
+    pos, fills = signals_to_positions_with_stops(
+        signals, ohlc, ohlc.O, stop_type='percent' if percent else 'point',
+        **stops)
+    ref_pos, ref_fills = reference(signals, ohlc, ohlc.O, percent=percent,
+                                   **stops)
+    assert len(fills) > 10
+    assert pos.index.equals(ref_pos.index)
+    numpy.testing.assert_array_equal(pos.values, ref_pos.values)
+    assert list(fills.index) == [ohlc.index[t] for t in sorted(ref_fills)]
+    numpy.testing.assert_allclose(fills.values,
+                                  [ref_fills[t] for t in sorted(ref_fills)])
+
+
+def test_huge_stops_do_not_change_positions():
+    ohlc = make_bars(500, 0)
+    signals = make_signals(ohlc, 1)
+    plain = Backtest(dict(ohlc=ohlc, **dict(
+        (c.lower(), signals[c]) for c in MASK)))
+    stopped = Backtest(dict(ohlc=ohlc, **dict(
+        (c.lower(), signals[c]) for c in MASK)), stop_loss=1e9)
+    assert stopped.positions.equals(plain.positions)
+    assert stopped.equity.equals(plain.equity)
+
+
+def test_exit_and_reentry_keeps_original_entry():
+    n = 8
+    ohlc = pandas.DataFrame(100., index=pandas.date_range(
+        '2020', periods=n, freq='h'), columns=list('OHLC'))
+    # long from bar 1, exit and entry on bar 2, price drops, then recovers
+    ohlc.iloc[3:5] = 95.
+    ohlc.loc[ohlc.index[5], 'H'] = 103.
+    buy = pandas.Series(False, index=ohlc.index)
+    buy.iloc[[0, 2]] = True
+    sell = pandas.Series(False, index=ohlc.index)
+    sell.iloc[2] = True
+    short = cover = pandas.Series(False, index=ohlc.index)
+    bt = Backtest(locals(), take_profit=2.)
+    assert list(bt.stop_fills.index) == [ohlc.index[5]]
+    assert bt.stop_fills.iloc[0] == 102.
+    assert bt.equity.sum() == 2.
+
+
+def test_take_profit_never_books_loss():
+    ohlc = make_bars(1500, 0)
+    signals = make_signals(ohlc, 100)
+    bt = Backtest(dict(ohlc=ohlc, **dict(
+        (c.lower(), signals[c]) for c in MASK)), take_profit=2.)
+    assert len(bt.stop_fills) > 10
+    assert (bt.equity[bt.stop_fills.index] >= 2. - 1e-9).all()
+
+
+def random_strategy(ohlc, stop_loss, seed=1):
+    signals = make_signals(ohlc, seed)
+    buy, sell, short, cover = [signals[c] for c in MASK]
+    stop_type = 'point'
+    return locals()
+
+
+def test_stops_are_read_from_dataobj():
+    ohlc = make_bars(500, 0)
+    from_args = Backtest(random_strategy(ohlc, None), stop_loss=1.5)
+    from_data = Backtest(random_strategy(ohlc, 1.5))
+    assert from_data.stop_loss == 1.5 and from_data.stop_type == 'point'
+    assert from_data.stop_fills.equals(from_args.stop_fills)
+    assert from_data.equity.equals(from_args.equity)
+    # arguments take precedence
+    assert Backtest(random_strategy(ohlc, 1.5), stop_loss=2.).stop_loss == 2.
+
+
+def test_optimizer_sweeps_stops():
+    ohlc = make_bars(500, 0)
+    opt = Optimizer(random_strategy, ohlc, params=dict(stop_loss=[1, 3, 1]),
+                    metrics=['profit'], processes=1)
+    res = opt.results.set_index('stop_loss')
+    for stop_loss in (1., 2., 3.):
+        bt = Backtest(random_strategy(ohlc, None), stop_loss=stop_loss)
+        assert res.profit[stop_loss] == bt.equity.sum()
+    assert res.profit.nunique() == 3
+
+
+def test_unknown_stop_type_is_rejected():
+    ohlc = make_bars(50, 0)
+    with pytest.raises(ValueError):
+        Backtest(random_strategy(ohlc, 1.), stop_type='points')